@@ -4,6 +4,8 @@ This file will act as a main file to run our search engine
 
 import asyncio
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from flask import Flask, request, jsonify, render_template
 
 from src.search_engine.utils.loggers import get_logger
@@ -12,12 +14,50 @@ from src.search_engine.crawler import WebCrawler
 from src.search_engine.indexer import Indexer
 from src.search_engine.query_response import QueryParser
 
+# uvloop is optional (it is not available on Windows), the stock asyncio loop is used without it
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 app = Flask(__name__)
 logger = get_logger(__name__)
 
-crawler = WebCrawler()
-indexer = Indexer()
-bg_loop = asyncio.new_event_loop()
+# Crawl and index tasks running in the background loop, they are waited for on shutdown
+_crawl_task: asyncio.Task | None = None
+_index_task: asyncio.Task | None = None
+
+
+# ------------------------------------ METHODS TO GET THE SHARED SERVICES ----------------------------------------------
+# The services are built on first use instead of at import time, the parse worker processes
+# import this module again when they start and must not build a crawler, index and event loop each
+
+
+@lru_cache(maxsize=None)
+def get_crawler() -> WebCrawler:
+    """
+    This method will create the crawler once and return the same crawler afterwards
+    """
+
+    return WebCrawler()
+
+
+@lru_cache(maxsize=None)
+def get_indexer() -> Indexer:
+    """
+    This method will create the indexer once and return the same indexer afterwards
+    """
+
+    return Indexer()
+
+
+@lru_cache(maxsize=None)
+def get_bg_loop() -> asyncio.AbstractEventLoop:
+    """
+    This method will create the background event loop once and return the same loop afterwards
+    """
+
+    return uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
 
 
 # -------------------------------- METHOD TO START AND STOP BACKGROUND TASK --------------------------------------------
@@ -28,11 +68,24 @@ def start_async_services():
     This method will start the crawling and indexing in background
     """
 
+    global _crawl_task, _index_task
+
+    crawler = get_crawler()
+    indexer = get_indexer()
+    bg_loop = get_bg_loop()
     asyncio.set_event_loop(bg_loop)
-    logger.info("Starting crawler and indexer in background event loop")
 
-    bg_loop.create_task(crawler.start_crawler())
-    bg_loop.create_task(
+    # DNS lookups (getaddrinfo) and file writes run in the default executor, which is
+    # too small by default for a full batch of concurrent requests
+    bg_loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=CommonVariables.DEFAULT_EXECUTOR_WORKERS)
+    )
+    logger.info(
+        "Starting crawler and indexer in background event loop: %s", type(bg_loop)
+    )
+
+    _crawl_task = bg_loop.create_task(crawler.start_crawler())
+    _index_task = bg_loop.create_task(
         indexer.start_indexing(crawler.page_model_frontier, crawler.crawl_done)
     )
 
@@ -44,14 +97,32 @@ def shutdown_async_services():
     This method will shut down the crawler and indexer
     """
 
+    bg_loop = get_bg_loop()
+
     async def _shutdown():
+        # Cancelling the crawl task and waiting for it, so its cleanup runs before the loop stops:
+        # the crawler flushes and closes the JSONL file and frees the parse pool and shared memory
+        if _crawl_task is not None:
+            _crawl_task.cancel()
+            await asyncio.gather(_crawl_task, return_exceptions=True)
+
+        # The stopped crawl has set crawl_done, so the indexer indexes the pages left in the queue,
+        # writes the documents indexed since its last checkpoint and stops on its own
+        if _index_task is not None:
+            await asyncio.gather(_index_task, return_exceptions=True)
+
+        crawler = get_crawler()
         try:
             await crawler.async_rest_client.aclose()
         except (asyncio.TimeoutError, RuntimeError, OSError) as e:
             logger.warning(
-                f"Failed to close the rest client being used by crawler with error: {e}"
+                "Failed to close the rest client being used by crawler with error: %s",
+                e,
             )
 
+        # A crawl task cancelled before it started never ran its cleanup, closing again is harmless
+        await asyncio.to_thread(crawler.close)
+
     asyncio.run_coroutine_threadsafe(_shutdown(), bg_loop).result(
         timeout=CommonVariables.TIMEOUT
     )
@@ -70,6 +141,22 @@ def home():
     return render_template("index.html")
 
 
+async def _search_in_bg_loop(query_text: str) -> list[dict]:
+    """
+    This method will run the query on the indexer's current index
+    """
+
+    indexer = get_indexer()
+    return QueryParser.generate_response_for_query(
+        query_text,
+        indexer.inverted_index,
+        indexer.doc_urls,
+        indexer.doc_titles,
+        indexer.term_top_postings,
+        indexer.index_version,
+    )
+
+
 @app.get("/search")
 def search():
     """
@@ -80,14 +167,10 @@ def search():
     if not query_text:
         return jsonify([])
 
-    # Submit the async search work to the background asyncio loop
+    # Submit the search work to the background asyncio loop, it must run in the loop's thread
+    # so the index is not changed by the indexer while the query reads it
     search_future = asyncio.run_coroutine_threadsafe(
-        QueryParser.generate_response_for_query(
-            query_text,
-            indexer.inverted_index,
-            indexer.doc_store,
-        ),
-        bg_loop,
+        _search_in_bg_loop(query_text), get_bg_loop()
     )
 
     try:
@@ -108,6 +191,11 @@ def main():
     Returns:
 
     """
+    # Building the services here, before the background thread and Flask can both ask for them
+    get_crawler()
+    get_indexer()
+    get_bg_loop()
+
     thread = threading.Thread(target=start_async_services, daemon=True)
     thread.start()
     try:
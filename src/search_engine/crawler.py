@@ -4,26 +4,35 @@ This file will contain the code to crawl the web pages
 
 import asyncio
 import json
+import os
 import httpx
-from typing import List
-from bs4 import BeautifulSoup
-from dataclasses import asdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import fields
+from typing import AsyncIterator, Iterable, List
 from pathlib import Path
 
 from src.search_engine.models.PageModel import PageModel
 from src.search_engine.utils.variables import CommonVariables
 from src.search_engine.utils.loggers import get_logger
-from src.search_engine.utils.string_utils import normalize_url, generate_content_hash
-from src.search_engine.utils.requests import prepare_async_requests, hit_async_requests
-from src.search_engine.utils.parse_html import (
-    extract_outgoing_links_from_soup,
-    extract_headings_from_soup,
-    extract_title_from_soup,
-    extract_content_from_soup,
+from src.search_engine.utils.string_utils import (
+    normalize_url,
+    generate_url_fingerprint,
+    get_host_from_url,
 )
+from src.search_engine.utils.shared_visited import SharedVisited
+from src.search_engine.utils.requests import prepare_async_requests, hit_async_requests
+from src.search_engine.utils.parse_html import make_page_model_from_content
 
 logger = get_logger(__name__)
 
+# PageModel uses slots (no __dict__), so the field names are looked up once here
+_PAGE_MODEL_FIELDS = tuple(field.name for field in fields(PageModel))
+
+# json.dumps builds a new JSONEncoder on every call when given options, so one is reused instead
+_JSONL_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
 
 class WebCrawler:
     """
@@ -36,30 +45,121 @@ class WebCrawler:
         """
 
         # Initialising some variables which we will need for crawling
+        # A larger keep-alive pool lets consecutive batches reuse connections instead of
+        # paying a new TCP/TLS handshake per request
         self.async_rest_client = httpx.AsyncClient(
             follow_redirects=True,
             headers=CommonVariables.HEADERS,
-            timeout=CommonVariables.TIMEOUT,
+            timeout=httpx.Timeout(
+                CommonVariables.TIMEOUT, connect=CommonVariables.CONNECT_TIMEOUT
+            ),
+            transport=httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=CommonVariables.MAX_CONNECTIONS,
+                    max_keepalive_connections=CommonVariables.MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=CommonVariables.KEEPALIVE_EXPIRY,
+                ),
+                retries=CommonVariables.CONNECT_RETRIES,
+            ),
+        )
+
+        # Capping the in-flight requests per host, so a single origin cannot hold the whole batch
+        self._host_semaphores = defaultdict(
+            lambda: asyncio.Semaphore(CommonVariables.MAX_REQUESTS_PER_HOST)
         )
-        self.visited_urls = set()
+        # Visited URLs are stored as 64-bit fingerprints, which are much smaller than the URL strings,
+        # in shared memory so the crawl can later be split over several processes
+        self.visited_urls = SharedVisited(capacity=CommonVariables.MAX_LIMIT)
+
+        # Remembering the fingerprint of every URL put in the frontier so each URL is queued
+        # at most once, visited URLs were all queued before so they are covered too
+        self._queued_urls: set[int] = set()
         self.page_model_frontier = asyncio.Queue(maxsize=CommonVariables.MAX_LIMIT)
         self.crawl_done = asyncio.Event()
 
+        # Parsing is CPU bound, so it runs in worker processes (one per available CPU)
+        # and the event loop stays free to send the next requests
+        self._parse_pool = ProcessPoolExecutor()
+
+        # Opening the JSONL file once, page records are buffered and written in batches
+        jsonl_path = Path(CommonVariables.JSONL_FILE_PATH)
+        jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        self._jsonl_file = jsonl_path.open("ab")
+        self._jsonl_buffer = bytearray()
+
         # Initializing URL frontier with seed URLs
-        self.url_frontier = asyncio.Queue(maxsize=CommonVariables.MAX_LIMIT)
+        # The frontier keeps one FIFO of URLs per host and a ring of the hosts having pending
+        # URLs, batches are picked round-robin over the hosts so one site cannot fill a batch
+        self.url_frontier: dict[str, deque[str]] = defaultdict(deque)
+        self._frontier_hosts: deque[str] = deque()
+        self.frontier_size = 0
         logger.debug(
-            f"Initializing URL frontier with seed URLs: [{CommonVariables.SEED_URLS}] "
-            f"and with max limit [{CommonVariables.MAX_LIMIT}]"
+            "Initializing URL frontier with seed URLs: [%s] and with max limit [%s]",
+            CommonVariables.SEED_URLS,
+            CommonVariables.MAX_LIMIT,
         )
-        for url in CommonVariables.SEED_URLS:
-            self.url_frontier.put_nowait(url)
+        # Seeds are normalized like every other URL, so their fingerprints match the links found later
+        self._extend_frontier([normalize_url(url) for url in CommonVariables.SEED_URLS])
 
-    async def _fetch_pages_for_urls_and_return_response(self) -> List[httpx.Response]:
+    def _extend_frontier(self, urls: Iterable[str]) -> int:
         """
-        This method will fetch the web pages for the URLs in the URL frontier.
+        This method will add the given normalized URLs at the end of their host's queue
+        in the URL frontier, skipping the ones which were already queued once
+
+        Args:
+            urls: normalized URLs to add
+
+        Returns:
+            int: number of URLs added
+        """
+
+        queued_urls = self._queued_urls
+        url_frontier = self.url_frontier
+        frontier_hosts = self._frontier_hosts
+
+        added_count = 0
+        for url in urls:
+            fingerprint = generate_url_fingerprint(url)
+            if fingerprint in queued_urls:
+                continue
+            queued_urls.add(fingerprint)
+
+            host = get_host_from_url(url)
+            host_urls = url_frontier[host]
+            if not host_urls:
+                frontier_hosts.append(host)
+            host_urls.append(url)
+            added_count += 1
+
+        self.frontier_size += added_count
+        return added_count
+
+    def _pop_url_from_frontier(self) -> str:
+        """
+        This method will take the next URL from the URL frontier, going round-robin over the hosts
 
         Returns:
-            List[httpx.Response]: A list of HTTP responses for the fetched web pages.
+            str: the next URL to crawl
+        """
+
+        host = self._frontier_hosts.popleft()
+        host_urls = self.url_frontier[host]
+        url = host_urls.popleft()
+        if host_urls:
+            self._frontier_hosts.append(host)
+        else:
+            del self.url_frontier[host]
+        self.frontier_size -= 1
+        return url
+
+    async def _fetch_pages_for_urls(
+        self,
+    ) -> AsyncIterator[httpx.Response | Exception]:
+        """
+        This method will fetch the web pages for a batch of URLs from the URL frontier.
+
+        Yields:
+            httpx.Response | Exception: The HTTP responses in the order they complete.
         """
 
         urls = []
@@ -67,19 +167,21 @@ class WebCrawler:
 
         count = 1
         while (
-            not self.url_frontier.empty()
+            self.frontier_size
             and count <= CommonVariables.BATCH_SIZE
             and len(self.visited_urls) < CommonVariables.MAX_LIMIT
         ):
             # Adding the URL in list to get response
-            url = self.url_frontier.get_nowait()
-            self.visited_urls.add(url)
+            url = self._pop_url_from_frontier()
+            self.visited_urls.add(generate_url_fingerprint(url))
             urls.append(url)
             count += 1
 
         requests = prepare_async_requests(urls, self.async_rest_client)
-        responses = await hit_async_requests(requests, self.async_rest_client)
-        return responses
+        async for response in hit_async_requests(
+            requests, self.async_rest_client, self._host_semaphores
+        ):
+            yield response
 
     async def _parse_response_and_make_page_model(
         self, response: httpx.Response
@@ -98,14 +200,14 @@ class WebCrawler:
         try:
             # Checking if the response is proper or not
             if not isinstance(response, httpx.Response):
-                logger.debug(f"Skipping invalid response object: {type(response)}")
+                logger.debug("Skipping invalid response object: %s", type(response))
                 return None
 
             # Checking the status code of the response
             url = str(response.request.url)
             if response.status_code != httpx.codes.OK:
                 logger.debug(
-                    f"Status code for URL [{url}] is {response.status_code}\n content: {response.content}"
+                    "Status code for URL [%s] is %s", url, response.status_code
                 )
                 return None
 
@@ -113,49 +215,83 @@ class WebCrawler:
             content_type = response.headers.get("Content-Type", "").lower()
             if "html" not in content_type and "xml" not in content_type:
                 logger.debug(
-                    f"Skipping non-parseable content type [{content_type}] for URL [{url}]"
+                    "Skipping non-parseable content type [%s] for URL [%s]",
+                    content_type,
+                    url,
                 )
                 return None
 
-            # Determine parser
-            parser = "lxml-xml" if "xml" in content_type else "html.parser"
-            try:
-                soup = BeautifulSoup(response.content, parser)
-            except Exception as parse_error:
-                logger.warning(
-                    f"Failed to parse {url} with {parser}, trying html.parser: {parse_error}"
-                )
-                soup = BeautifulSoup(response.content, "html.parser")
-
-            # Fetching required details
-            content = extract_content_from_soup(soup)
-            doc_id = generate_content_hash(content)
-            links = extract_outgoing_links_from_soup(soup)
-
-            # Building the PageModel
-            page_model = PageModel(
-                doc_id=doc_id,
-                url=url,
-                final_url=str(response.url),
-                http_status=response.status_code,
-                title=extract_title_from_soup(soup),
-                headings=extract_headings_from_soup(soup),
-                content=content,
-                links=links,
+            # Parsing the page in the process pool, only bytes and strings are sent to the worker
+            loop = asyncio.get_running_loop()
+            parse_pool = self._parse_pool
+            page_model = await loop.run_in_executor(
+                parse_pool,
+                make_page_model_from_content,
+                url,
+                str(response.url),
+                response.status_code,
+                response.content,
+                "xml" in content_type,
+                response.charset_encoding,
             )
 
             # Adding the page model in page model queue
             self.page_model_frontier.put_nowait(page_model)
-            logger.debug(f"Successfully processed response for URL [{url}]")
+            logger.debug("Successfully processed response for URL [%s]", url)
             return page_model
+        except BrokenProcessPool as e:
+            # A dead parse worker breaks the whole pool, every later page would fail as well
+            logger.error(
+                "Parse pool is broken, dropping page [%s] and starting a new pool: %s",
+                url,
+                e,
+            )
+            self._replace_broken_parse_pool(parse_pool)
+            return None
         except Exception as e:
-            logger.debug(f"Error processing response: {e}", exc_info=True)
+            logger.debug("Error processing response: %s", e, exc_info=True)
             return None
 
+    def _replace_broken_parse_pool(self, broken_pool: ProcessPoolExecutor) -> None:
+        """
+        This method will replace the given broken parse pool with a new one
+
+        Args:
+            broken_pool: parse pool which raised BrokenProcessPool
+
+        Returns:
+            None
+        """
+
+        # All the pages parsed in the broken pool fail together, the pool is replaced only once
+        if self._parse_pool is not broken_pool:
+            return
+
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+        self._parse_pool = ProcessPoolExecutor()
+
+    async def _process_response(
+        self, response: httpx.Response | Exception
+    ) -> PageModel | None:
+        """
+        This method will parse the given response and write its page model in JSONL
+
+        Args:
+            response: HTTP response to process
+
+        Returns:
+            PageModel or None
+        """
+
+        page_model = await self._parse_response_and_make_page_model(response)
+        if page_model:
+            await self._write_page_to_jsonl(page_model)
+        return page_model
+
     async def _write_page_to_jsonl(self, page_model: PageModel) -> None:
         """
-        Ensures JSONL file exists and optionally appends a PageModel record.
-        The file becomes visible immediately after creation, even if empty.
+        Buffers a PageModel record for the JSONL file, the buffer is written
+        to disk once it holds JSONL_BUFFER_SOFT_MAX bytes.
 
         Args:
             page_model: PageModel to write
@@ -164,20 +300,46 @@ class WebCrawler:
             None
         """
 
-        jsonl_path = Path(CommonVariables.JSONL_FILE_PATH)
+        # PageModel only holds primitives and lists of str, so its fields can be
+        # serialized as is without the recursive copy done by dataclasses.asdict
+        record_dict = {name: getattr(page_model, name) for name in _PAGE_MODEL_FIELDS}
+        buffer = self._jsonl_buffer
+        buffer += _JSONL_ENCODER.encode(record_dict).encode("utf-8")
+        buffer += b"\n"
 
-        # Ensure parent directory exists
-        jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        # Flushing on size rather than on record count, so large pages cannot grow the buffer unbounded
+        if len(buffer) >= CommonVariables.JSONL_BUFFER_SOFT_MAX:
+            await self._flush_jsonl_buffer()
+
+    async def _flush_jsonl_buffer(self) -> None:
+        """
+        This method will write all the buffered records in the JSONL file,
+        the write happens in a worker thread so the event loop is never blocked on disk
 
-        # Touch the file so it exists immediately
-        jsonl_path.touch(exist_ok=True)
+        Returns:
+            None
+        """
+
+        if not self._jsonl_buffer:
+            return
+
+        # Swapping the buffer first so records added while writing go in the next batch
+        data, self._jsonl_buffer = self._jsonl_buffer, bytearray()
+        await asyncio.to_thread(self._jsonl_file.write, data)
+
+    def _sync_jsonl_file(self) -> None:
+        """
+        This method will flush the JSONL file and make the OS write it to disk,
+        so the records written so far survive a crash
+
+        Returns:
+            None
+        """
 
-        # Append JSONL record
-        with jsonl_path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(asdict(page_model), ensure_ascii=False) + "\n")
-            f.flush()
+        self._jsonl_file.flush()
+        os.fsync(self._jsonl_file.fileno())
 
-    async def _add_urls_in_queue(self, urls: List[str], source_url: str = None) -> None:
+    def _add_urls_in_queue(self, urls: List[str], source_url: str = None) -> None:
         """
         This method will check the queue capacity and accordingly will add the given URLs in the queue
 
@@ -190,14 +352,20 @@ class WebCrawler:
         """
 
         # Calculate available space
-        queue_size = self.url_frontier.qsize()
+        queue_size = self.frontier_size
         available_space = CommonVariables.MAX_LIMIT - queue_size
         logger.debug(
-            f"Attempting to add {len(urls)} URLs. Queue: {queue_size}/{CommonVariables.MAX_LIMIT}, Available: {available_space}"
+            "Attempting to add %d URLs. Queue: %d/%d, Available: %d",
+            len(urls),
+            queue_size,
+            CommonVariables.MAX_LIMIT,
+            available_space,
         )
         if available_space <= 0:
             logger.debug(
-                f"Queue is full. Current size: {queue_size}, Max limit: {CommonVariables.MAX_LIMIT}"
+                "Queue is full. Current size: %d, Max limit: %d",
+                queue_size,
+                CommonVariables.MAX_LIMIT,
             )
             return
 
@@ -205,27 +373,40 @@ class WebCrawler:
         urls_len = len(urls)
         urls_to_add = min(urls_len, available_space)
 
-        # Add URLs to queue
-        added_count = 0
-        for url in urls[:urls_to_add]:
-            normalized = normalize_url(url, source_url=source_url)
-            if normalized not in self.visited_urls:
-                await self.url_frontier.put(normalized)
-                added_count += 1
+        # Normalizing all the URLs first, then adding them to queue in one go
+        normalized_urls = [
+            normalize_url(url, source_url=source_url) for url in urls[:urls_to_add]
+        ]
+        added_count = self._extend_frontier(normalized_urls)
 
         logger.debug(
-            f"Successfully added {added_count} new URLs to queue (skipped {urls_to_add - added_count} duplicates)"
-        )
-        logger.debug(
-            f"New queue size: {self.url_frontier.qsize()}/{CommonVariables.MAX_LIMIT}"
+            "Successfully added %d new URLs to queue (skipped %d duplicates), new queue size: %d/%d",
+            added_count,
+            urls_to_add - added_count,
+            queue_size + added_count,
+            CommonVariables.MAX_LIMIT,
         )
 
         # Log if we couldn't add all URLs
         if urls_to_add < urls_len:
             logger.debug(
-                f"Could not add {urls_len - urls_to_add} URLs due to queue capacity limit"
+                "Could not add %d URLs due to queue capacity limit",
+                urls_len - urls_to_add,
             )
 
+    def close(self) -> None:
+        """
+        This method will free the resources the crawler holds outside of the event loop,
+        the parse worker processes and the shared memory of the visited URLs.
+        It can be called more than once
+
+        Returns:
+            None
+        """
+
+        self._parse_pool.shutdown(cancel_futures=True)
+        self.visited_urls.close()
+
     async def start_crawler(self) -> None:
         """
         This method is main method to start our crawler
@@ -235,50 +416,69 @@ class WebCrawler:
 
         try:
             while (
-                not self.url_frontier.empty()
+                self.frontier_size
                 and len(self.visited_urls) < CommonVariables.MAX_LIMIT
             ):
                 iteration += 1
-                logger.debug(f"=== ITERATION {iteration} START ===")
-                logger.debug(f"Queue size at start: {self.url_frontier.qsize()}")
-                logger.debug(f"Visited URLs count: {len(self.visited_urls)}")
-
-                responses = await self._fetch_pages_for_urls_and_return_response()
-                logger.debug(f"Fetched {len(responses)} responses")
-
-                for resp_count, response in enumerate(responses, 1):
-                    if len(self.visited_urls) >= CommonVariables.MAX_LIMIT:
-                        break
+                logger.debug(
+                    "=== ITERATION %d START === queue size: %d, visited URLs: %d",
+                    iteration,
+                    self.frontier_size,
+                    len(self.visited_urls),
+                )
 
-                    logger.debug(f"Parsing response {resp_count}/{len(responses)}")
-                    page_model = await self._parse_response_and_make_page_model(
-                        response
+                # Each response is handed to the parse pool as soon as it arrives, so
+                # parsing overlaps with the requests still in flight
+                process_tasks = []
+                try:
+                    async for response in self._fetch_pages_for_urls():
+                        process_tasks.append(
+                            asyncio.create_task(self._process_response(response))
+                        )
+                except asyncio.CancelledError:
+                    # The responses already being parsed are cancelled and waited for too, so
+                    # none of them touches the JSONL file or the parse pool during the cleanup
+                    for task in process_tasks:
+                        task.cancel()
+                    await asyncio.gather(*process_tasks, return_exceptions=True)
+                    raise
+                logger.debug("Fetched %d responses", len(process_tasks))
+
+                # Waiting for the whole batch before fetching the next one
+                page_models = await asyncio.gather(*process_tasks)
+
+                # Adding outgoing URLs of the batch in url frontier in one go, once parsing is done
+                for page_model in page_models:
+                    if not page_model:
+                        continue
+
+                    logger.debug(
+                        "Adding %d links found on page [%s] in queue",
+                        len(page_model.links),
+                        page_model.final_url,
                     )
+                    self._add_urls_in_queue(page_model.links, page_model.final_url)
 
-                    if page_model:
-                        logger.debug("Writing the page model in JSONL")
-                        await self._write_page_to_jsonl(page_model)
-
-                        # Adding outgoing URLs from the above page model in url frontier
-                        final_url = page_model.final_url
-                        links = page_model.links
-                        logger.debug(
-                            f"Adding links found from above page [{links}] in queue"
-                        )
-                        await self._add_urls_in_queue(links, final_url)
+                # Checkpointing the JSONL file once per batch, instead of flushing every record
+                await self._flush_jsonl_buffer()
+                await asyncio.to_thread(self._sync_jsonl_file)
 
-                logger.debug(f"=== ITERATION {iteration} END ===\n")
+                logger.debug("=== ITERATION %d END ===", iteration)
 
-            if self.url_frontier.empty():
-                logger.info(
-                    f"Crawler stopped. Final queue size: {self.url_frontier.qsize()}"
-                )
-                logger.info(f"Total URLs visited: {len(self.visited_urls)}")
+            if not self.frontier_size:
+                logger.info("Crawler stopped. Final queue size: %d", self.frontier_size)
+                logger.info("Total URLs visited: %d", len(self.visited_urls))
 
             if len(self.visited_urls) > CommonVariables.MAX_LIMIT:
                 logger.info(
-                    f"Crawler stopped. Reached the Max Limit to crawl URLs {len(self.visited_urls)}/{CommonVariables.MAX_LIMIT}"
+                    "Crawler stopped. Reached the Max Limit to crawl URLs %d/%d",
+                    len(self.visited_urls),
+                    CommonVariables.MAX_LIMIT,
                 )
 
         finally:
+            await self._flush_jsonl_buffer()
+            await asyncio.to_thread(self._sync_jsonl_file)
+            await asyncio.to_thread(self._jsonl_file.close)
+            await asyncio.to_thread(self.close)
             self.crawl_done.set()
@@ -4,7 +4,6 @@ and to make an inverted index
 """
 
 import asyncio
-from typing import Any
 import json
 from collections import Counter, defaultdict
 from pathlib import Path
@@ -19,6 +18,9 @@ from src.search_engine.models.TokenType import TokenType, TOKEN_TYPE_WEIGHTS
 
 logger = get_logger(__name__)
 
+# Separators of the most compact JSON output, without the spaces after "," and ":"
+_COMPACT_SEPARATORS = (",", ":")
+
 
 class Indexer:
     """
@@ -33,7 +35,43 @@ class Indexer:
         self.inverted_index: dict[str, dict[str, int]] = defaultdict(
             lambda: defaultdict(int)
         )
-        self.doc_store: dict[str, dict[str, Any]] = defaultdict(dict)
+
+        # The doc store is kept as one dict per field (doc_id -> value), queries only read the
+        # url and title, and only a short snippet of the content is kept instead of the full page
+        self.doc_urls: dict[str, str] = {}
+        self.doc_titles: dict[str, str] = {}
+        self.doc_snippets: dict[str, str] = {}
+
+        # Highest scored postings of the terms, computed by the queries when first needed
+        # and dropped here every time the posting of the term changes
+        self.term_top_postings: dict[str, list[tuple[str, int]]] = {}
+
+        # Incremented for every indexed document, so cached query results can tell the index changed
+        self.index_version = 0
+
+    @staticmethod
+    def _accumulate_term_scores(
+        text: str, weightage: int, term_scores: dict[str, int]
+    ) -> None:
+        """
+        This method will tokenize the given text and add the frequency of each word,
+        multiplied by the weightage, in the term scores. Stop words are skipped
+
+        Args:
+            text: text to tokenize
+            weightage: weightage of the token type of the text
+            term_scores: term scores of the document
+
+        Returns:
+            None
+        """
+
+        # Stop words are skipped once per distinct term, after counting, rather than per token
+        stop_words = CommonVariables.STOP_WORDS
+        term_freq = Counter(tokenize_content_into_list_of_words(text))
+        for term, freq in term_freq.items():
+            if term not in stop_words:
+                term_scores[term] += freq * weightage
 
     async def _create_inverted_index_for_page_model(self, model: PageModel) -> None:
         """
@@ -48,48 +86,32 @@ class Indexer:
 
         doc_id = model.doc_id
         logger.debug(
-            f"Making an inverted index for tokens present in page with id {doc_id}"
+            "Making an inverted index for tokens present in page with id %s", doc_id
         )
 
         # Accumulate total weighted score per term for this document
         term_scores = defaultdict(int)
 
-        # Tokenizing the content and getting frequency of each word
-        content = model.content or ""
-        tokens = tokenize_content_into_list_of_words(content)
-        term_freq = Counter(tokens)
-        weightage = TOKEN_TYPE_WEIGHTS[TokenType.CONTENT]
-        for term, freq in term_freq.items():
-            if term in CommonVariables.STOP_WORDS:
-                continue
-            term_scores[term] += freq * weightage
-
-        # Tokenizing the headings and getting frequency of each word
-        headings = model.headings or []
-        headings = " ".join(headings)
-        tokens = tokenize_content_into_list_of_words(headings)
-        term_freq = Counter(tokens)
-        weightage = TOKEN_TYPE_WEIGHTS[TokenType.HEADING]
-        for term, freq in term_freq.items():
-            if term in CommonVariables.STOP_WORDS:
-                continue
-            term_scores[term] += freq * weightage
-
-        # Tokenizing the title and getting frequency of each word
-        title = model.title or ""
-        tokens = tokenize_content_into_list_of_words(title)
-        term_freq = Counter(tokens)
-        weightage = TOKEN_TYPE_WEIGHTS[TokenType.TITLE]
-        for term, freq in term_freq.items():
-            if term in CommonVariables.STOP_WORDS:
-                continue
-            term_scores[term] += freq * weightage
+        # Tokenizing each field and adding its weighted term frequencies
+        self._accumulate_term_scores(
+            model.content or "", TOKEN_TYPE_WEIGHTS[TokenType.CONTENT], term_scores
+        )
+        self._accumulate_term_scores(
+            " ".join(model.headings or []),
+            TOKEN_TYPE_WEIGHTS[TokenType.HEADING],
+            term_scores,
+        )
+        self._accumulate_term_scores(
+            model.title or "", TOKEN_TYPE_WEIGHTS[TokenType.TITLE], term_scores
+        )
 
         # Merge into global inverted index
+        term_top_postings = self.term_top_postings
         for term, score in term_scores.items():
             self.inverted_index[term][doc_id] += score
+            term_top_postings.pop(term, None)
 
-        logger.debug(f"Indexed doc_id={doc_id}")
+        logger.debug("Indexed doc_id=%s", doc_id)
 
     async def _write_inverted_index_in_json(self) -> None:
         """
@@ -101,19 +123,19 @@ class Indexer:
 
         json_path = Path(CommonVariables.INVERTED_INDEX_FILE_PATH)
         json_path.parent.mkdir(parents=True, exist_ok=True)
-        json_path.touch(exist_ok=True)
 
-        inverted_index_dict = {
-            term: dict(postings) for term, postings in self.inverted_index.items()
-        }
-        with json_path.open("w", encoding="utf-8") as f:
-            json.dump(inverted_index_dict, f, ensure_ascii=False, indent=4)
-            f.flush()
+        # json.dumps encodes in one pass with the C encoder (json.dump falls back to the
+        # pure Python one to write chunks), and defaultdicts are encoded as plain dicts.
+        # The file is not meant to be read by people, so it is written without any whitespace
+        data = json.dumps(
+            self.inverted_index, ensure_ascii=False, separators=_COMPACT_SEPARATORS
+        )
+        json_path.write_bytes(data.encode("utf-8"))
 
     async def _create_doc_store_for_page_model(self, model: PageModel) -> None:
         """
         This method will create a doc store for the given page model
-        which will provide the necessary details from page model, final_url, title, some content
+        which will provide the necessary details from page model, final_url, title, a snippet of the content
 
         Args:
             model:
@@ -123,11 +145,12 @@ class Indexer:
             None
         """
 
-        self.doc_store[model.doc_id] = {
-            "url": model.final_url,
-            "title": model.title,
-            "content": model.content,
-        }
+        doc_id = model.doc_id
+        self.doc_urls[doc_id] = model.final_url
+        self.doc_titles[doc_id] = model.title
+        self.doc_snippets[doc_id] = (model.content or "")[
+            : CommonVariables.SNIPPET_LENGTH
+        ]
 
     async def _write_doc_store_in_json(self) -> None:
         """
@@ -139,12 +162,14 @@ class Indexer:
 
         json_path = Path(CommonVariables.DOC_STORE_FILE_PATH)
         json_path.parent.mkdir(parents=True, exist_ok=True)
-        json_path.touch(exist_ok=True)
 
-        doc_store = {term: dict(postings) for term, postings in self.doc_store.items()}
-        with json_path.open("w", encoding="utf-8") as f:
-            json.dump(doc_store, f, ensure_ascii=False, indent=4)
-            f.flush()
+        doc_store = {
+            "urls": self.doc_urls,
+            "titles": self.doc_titles,
+            "snippets": self.doc_snippets,
+        }
+        data = json.dumps(doc_store, ensure_ascii=False, separators=_COMPACT_SEPARATORS)
+        json_path.write_bytes(data.encode("utf-8"))
 
     async def start_indexing(
         self,
@@ -163,19 +188,30 @@ class Indexer:
             None
         """
 
-        while True:
-            if crawl_done.is_set() and page_model_queue.empty():
-                break
-
-            try:
-                model = await asyncio.wait_for(page_model_queue.get(), timeout=0.5)
-            except asyncio.TimeoutError:
-                continue
-
-            try:
-                await self._create_inverted_index_for_page_model(model)
-                await self._create_doc_store_for_page_model(model)
-            finally:
-                await self._write_inverted_index_in_json()
-                await self._write_doc_store_in_json()
-                page_model_queue.task_done()
+        # The files are rewritten as a whole, so they are only checkpointed every few documents
+        # and once more when indexing stops, instead of after every page
+        indexed_count = 0
+        try:
+            while True:
+                if crawl_done.is_set() and page_model_queue.empty():
+                    break
+
+                try:
+                    model = await asyncio.wait_for(page_model_queue.get(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+
+                try:
+                    await self._create_inverted_index_for_page_model(model)
+                    await self._create_doc_store_for_page_model(model)
+                    self.index_version += 1
+                    indexed_count += 1
+                finally:
+                    page_model_queue.task_done()
+
+                if indexed_count % CommonVariables.INDEX_CHECKPOINT_SIZE == 0:
+                    await self._write_inverted_index_in_json()
+                    await self._write_doc_store_in_json()
+        finally:
+            await self._write_inverted_index_in_json()
+            await self._write_doc_store_in_json()
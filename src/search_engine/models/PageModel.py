@@ -6,7 +6,7 @@ from dataclasses import dataclass
 from typing import List
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PageModel:
     doc_id: str
     url: str
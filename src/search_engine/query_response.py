@@ -2,12 +2,87 @@
 This file contains the code to make a response according to the user's query
 """
 
-from collections import defaultdict
 import heapq
+from collections import OrderedDict
+from operator import add, itemgetter
+from typing import Iterable
 
 from src.search_engine.utils.string_utils import tokenize_content_into_list_of_words
 from src.search_engine.utils.variables import CommonVariables
 
+# Results of the latest queries, least recently used first. The key holds the index version,
+# so results computed before the index changed are never served again and just age out
+_result_cache: OrderedDict[tuple, tuple[dict, ...]] = OrderedDict()
+
+
+def _add_results_in_cache(cache_key: tuple, results: list[dict]) -> None:
+    """
+    This method will add the results of a query in the result cache, evicting the
+    least recently used results when the cache is full
+
+    Args:
+        cache_key: tokens of the query, response size and index version
+        results: results of the query
+
+    Returns:
+        None
+    """
+
+    _result_cache[cache_key] = tuple(results)
+    if len(_result_cache) > CommonVariables.RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+
+# Up to this many scored docs, a full sort in C is faster than heapq.nlargest's Python level heap
+_SORT_SELECTION_MAX_SIZE = 1000
+
+
+def _get_top_scored_doc_ids(doc_scores: dict[str, int], count: int) -> list[str]:
+    """
+    This method will return the ids of the docs having the highest scores, best first
+
+    Args:
+        doc_scores: score of each doc
+        count: number of doc ids to return
+
+    Returns:
+        list of doc ids
+    """
+
+    # Both keep the docs having equal scores in their insertion order
+    if len(doc_scores) <= _SORT_SELECTION_MAX_SIZE:
+        return sorted(doc_scores, key=doc_scores.__getitem__, reverse=True)[:count]
+    return heapq.nlargest(count, doc_scores, key=doc_scores.__getitem__)
+
+
+def _get_top_postings(
+    token: str, posting: dict[str, int], term_top_postings: dict[str, list]
+) -> Iterable[tuple[str, int]]:
+    """
+    This method will return the TOP_K_PER_TERM highest scored (doc_id, score) pairs of the
+    token's posting. They are cached per token, the indexer drops the cached pairs of a token
+    whenever its posting changes
+
+    Args:
+        token: token of the query
+        posting: posting of the token (doc_id -> score)
+        term_top_postings: cached top postings of each token
+
+    Returns:
+        the top (doc_id, score) pairs of the posting
+    """
+
+    if len(posting) <= CommonVariables.TOP_K_PER_TERM:
+        return posting.items()
+
+    top_postings = term_top_postings.get(token)
+    if top_postings is None:
+        # faster to use heapq.nlargest on dict.items()
+        top_postings = term_top_postings[token] = heapq.nlargest(
+            CommonVariables.TOP_K_PER_TERM, posting.items(), key=itemgetter(1)
+        )
+    return top_postings
+
 
 class QueryParser:
     """
@@ -15,8 +90,13 @@ class QueryParser:
     """
 
     @staticmethod
-    async def generate_response_for_query(
-        query: str, inverted_index: dict, doc_store: dict
+    def generate_response_for_query(
+        query: str,
+        inverted_index: dict,
+        doc_urls: dict[str, str],
+        doc_titles: dict[str, str],
+        term_top_postings: dict[str, list],
+        index_version: int,
     ) -> list[dict]:
         """
         This method will prepare a response for the user's query
@@ -24,48 +104,51 @@ class QueryParser:
         Args:
             query: user's query
             inverted_index: inverted index
-            doc_store: doc store
+            doc_urls: url of each document
+            doc_titles: title of each document
+            term_top_postings: cached top postings of each term, filled while answering queries
+            index_version: version of the index, changes every time a document is indexed
 
         Returns:
             list of documents to show to user in form of dict
         """
 
         resp_size = int(CommonVariables.RESPONSE_SIZE)
-        tokens = tokenize_content_into_list_of_words(query)
+        tokens = tuple(tokenize_content_into_list_of_words(query, drop_stop_words=True))
+
+        # Serving repeated queries from the result cache, as long as the index has not changed
+        cache_key = (tokens, resp_size, index_version)
+        cached_results = _result_cache.get(cache_key)
+        if cached_results is not None:
+            _result_cache.move_to_end(cache_key)
+            return list(cached_results)
 
-        posting_sets = []  # list of sets of doc_ids for each token found
         token_postings = {}  # token -> posting dict (doc_id -> score)
         posting_sizes = []  # list of (size, token) for sorting
 
         for token in tokens:
-            if token in CommonVariables.STOP_WORDS:
-                continue
-
             posting = inverted_index.get(token)
             if not posting:
                 continue
 
             token_postings[token] = posting
-            posting_sets.append(set(posting.keys()))
             posting_sizes.append((len(posting), token))
 
         # If no token matched at all
-        if not posting_sets:
+        if not token_postings:
             return []
 
         # Intersect smallest-first
         posting_sizes.sort(key=lambda x: x[0])
         sorted_tokens_by_size = [tok for _size, tok in posting_sizes]
 
-        # Build intersection iteratively (start from smallest)
-        common_set = None
-        for tok in sorted_tokens_by_size:
-            s = set(token_postings[tok].keys())
-            if common_set is None:
-                common_set = s
-            else:
-                common_set &= s
-            if not common_set:
+        # Build intersection iteratively (start from smallest): the docs of the smallest posting
+        # are probed in the other posting dicts, which are already hashed on doc_id
+        common_docs = list(token_postings[sorted_tokens_by_size[0]])
+        for tok in sorted_tokens_by_size[1:]:
+            posting = token_postings[tok]
+            common_docs = [doc_id for doc_id in common_docs if doc_id in posting]
+            if not common_docs:
                 break
 
         # If we have AND hits, compute scores only for those docs.
@@ -73,20 +156,20 @@ class QueryParser:
         selected_doc_ids = []
         selected_doc_ids_set = set()
 
-        if common_set:
-            # compute score only for docs in common_set
-            doc_scores = defaultdict(int)
-            for tok, posting in token_postings.items():
-                # posting is dict doc_id->score
-                for doc_id in common_set:
-                    # use .get to avoid KeyError; most terms may not have all docs in common_set but that's OK
-                    s = posting.get(doc_id)
-                    if s:
-                        doc_scores[doc_id] += s
-
-            # rank AND results
-            common_docs_ordered = sorted(
-                common_set, key=lambda d: doc_scores.get(d, 0), reverse=True
+        if common_docs:
+            # compute score only for docs in common_docs, every one of them is in the posting
+            # of every token, so the scores are summed column by column with map (in C)
+            common_scores = [0] * len(common_docs)
+            for posting in token_postings.values():
+                common_scores = list(
+                    map(add, common_scores, map(posting.__getitem__, common_docs))
+                )
+            doc_scores = dict(zip(common_docs, common_scores))
+            doc_scores_get = doc_scores.get
+
+            # rank AND results, only the docs which can be shown are kept in order
+            common_docs_ordered = heapq.nlargest(
+                resp_size, common_docs, key=doc_scores.__getitem__
             )
             for doc_id in common_docs_ordered:
                 if len(selected_doc_ids) >= resp_size:
@@ -106,74 +189,51 @@ class QueryParser:
                 # accumulate scores (but only from top K postings per term)
                 for tok, posting in token_postings.items():
                     # posting: dict doc->score; get top K doc-score pairs
-                    if len(posting) <= CommonVariables.TOP_K_PER_TERM:
-                        candidates = posting.items()
-                    else:
-                        # faster to use heapq.nlargest on dict.items()
-                        candidates = heapq.nlargest(
-                            CommonVariables.TOP_K_PER_TERM,
-                            posting.items(),
-                            key=lambda it: it[1],
-                        )
+                    candidates = _get_top_postings(tok, posting, term_top_postings)
                     for doc_id, s in candidates:
                         if doc_id in selected_doc_ids_set:
                             continue
 
                         # add to a global doc_scores (only for OR candidate pool)
-                        # we can use a dict for accumulation
                         # to avoid recomputing, reuse the earlier doc_scores for AND candidates
-                        # ensure doc_scores exists:
-                        try:
-                            doc_scores  # if defined earlier
-                        except NameError:
-                            doc_scores = defaultdict(int)
-                        doc_scores[doc_id] += s
+                        doc_scores[doc_id] = doc_scores_get(doc_id, 0) + s
 
                     # pick top (remaining_needed) docs from doc_scores
                     if doc_scores:
-                        top_or = heapq.nlargest(
-                            remaining_needed, doc_scores.items(), key=lambda it: it[1]
-                        )
-                        for doc_id, _score in top_or:
+                        top_or = _get_top_scored_doc_ids(doc_scores, remaining_needed)
+                        for doc_id in top_or:
                             if doc_id in selected_doc_ids_set:
                                 continue
                             selected_doc_ids.append(doc_id)
                             selected_doc_ids_set.add(doc_id)
         else:
             # No AND hits → do OR-only approach but limit per-term scanning
-            doc_scores = defaultdict(int)
+            doc_scores = {}
+            doc_scores_get = doc_scores.get
             for tok, posting in token_postings.items():
-                if len(posting) <= CommonVariables.TOP_K_PER_TERM:
-                    candidates = posting.items()
-                else:
-                    candidates = heapq.nlargest(
-                        CommonVariables.TOP_K_PER_TERM,
-                        posting.items(),
-                        key=lambda it: it[1],
-                    )
+                candidates = _get_top_postings(tok, posting, term_top_postings)
                 for doc_id, s in candidates:
-                    doc_scores[doc_id] += s
+                    doc_scores[doc_id] = doc_scores_get(doc_id, 0) + s
 
             # pick top resp_size docs
-            top_docs = heapq.nlargest(
-                resp_size, doc_scores.items(), key=lambda it: it[1]
-            )
-            for doc_id, _score in top_docs:
+            top_docs = _get_top_scored_doc_ids(doc_scores, resp_size)
+            for doc_id in top_docs:
                 selected_doc_ids.append(doc_id)
                 selected_doc_ids_set.add(doc_id)
 
-        # Build result objects from doc_store
+        # Build result objects from doc store
         results = []
         for doc_id in selected_doc_ids:
-            meta = doc_store.get(doc_id)
-            if not meta:
+            url = doc_urls.get(doc_id)
+            if url is None:
                 continue
             results.append(
                 {
                     "doc_id": doc_id,
-                    "url": meta.get("url", ""),
-                    "title": meta.get("title", "[COULD NOT FIND TITLE]"),
+                    "url": url,
+                    "title": doc_titles.get(doc_id, "[COULD NOT FIND TITLE]"),
                 }
             )
 
+        _add_results_in_cache(cache_key, results)
         return results
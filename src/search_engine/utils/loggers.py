@@ -2,43 +2,38 @@
 This file will contain the code to setup logging
 """
 
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 from pathlib import Path
 from datetime import datetime
 
+# Handlers of this process, installed on the root logger by the first setup_logger call
+_root_logger_configured = False
+_queue_handler: logging.handlers.QueueHandler | None = None
+_queue_listener: logging.handlers.QueueListener | None = None
 
-def setup_logger(name: str, log_file: str = None, level=logging.DEBUG):
+
+def _configure_root_logger(log_file: Path) -> None:
     """
-    Set up a logger with console and file handlers.
+    Install the console and file handlers once per process, on the root logger.
+    The logging calls only format the message of a record and put it in a queue,
+    a background thread formats the full log lines and writes them to the handlers.
 
     Args:
-        name: Logger name (usually __name__ from calling module)
-        log_file: Path to log file (optional, defaults to logs/search_engine.log)
-        level: Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+        log_file: Path to log file
 
     Returns:
-        logging.Logger: Configured logger instance
+        None
     """
 
-    # Create logs directory if it doesn't exist
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-
-    # Default log file with timestamp
-    if log_file is None:
-        timestamp = datetime.now().strftime("%Y%m%d")
-        log_file = log_dir / f"search_engine_{timestamp}.log"
-    else:
-        log_file = log_dir / log_file
-
-    # Create logger
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-
-    # Avoid duplicate handlers if logger already exists
-    if logger.handlers:
-        return logger
+    global _root_logger_configured, _queue_handler, _queue_listener
+    if _root_logger_configured:
+        return
+    _root_logger_configured = True
 
     # Create formatters
     detailed_formatter = logging.Formatter(
@@ -60,9 +55,87 @@ def setup_logger(name: str, log_file: str = None, level=logging.DEBUG):
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(detailed_formatter)
 
-    # Add handlers to logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    # The root logger level is left as it is, so only our loggers (which set their own
+    # level) reach the handlers below WARNING, not the ones of libraries like httpx
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    logging.getLogger().addHandler(_queue_handler)
+
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+    _queue_listener.start()
+
+
+def _stop_queue_listener() -> None:
+    """
+    Write the records still in the queue and stop the listener thread, if this process has one.
+
+    Returns:
+        None
+    """
+
+    if _queue_listener is not None:
+        _queue_listener.stop()
+
+
+def _write_to_handlers_after_fork() -> None:
+    """
+    A forked child inherits the queue handler but not the listener thread, so its records
+    would pile up in its copy of the queue. The child writes to the handlers directly instead.
+
+    Returns:
+        None
+    """
+
+    global _queue_handler, _queue_listener
+    if _queue_listener is None:
+        return
+
+    root_logger = logging.getLogger()
+    root_logger.removeHandler(_queue_handler)
+    for handler in _queue_listener.handlers:
+        root_logger.addHandler(handler)
+    _queue_handler = _queue_listener = None
+
+
+atexit.register(_stop_queue_listener)
+# os.register_at_fork is not available on Windows, where processes are never forked
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_write_to_handlers_after_fork)
+
+
+def setup_logger(name: str, log_file: str = None, level=logging.DEBUG):
+    """
+    Set up a logger writing to the console and file handlers shared by the whole process.
+
+    Args:
+        name: Logger name (usually __name__ from calling module)
+        log_file: Path to log file (optional, defaults to logs/search_engine.log), only
+            the first call of the process opens it
+        level: Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+
+    Returns:
+        logging.Logger: Configured logger instance
+    """
+
+    # Create logs directory if it doesn't exist
+    log_dir = Path("logs")
+    log_dir.mkdir(exist_ok=True)
+
+    # Default log file with timestamp
+    if log_file is None:
+        timestamp = datetime.now().strftime("%Y%m%d")
+        log_file = log_dir / f"search_engine_{timestamp}.log"
+    else:
+        log_file = log_dir / log_file
+
+    # Handlers live on the root logger, the module loggers reach them by propagation
+    _configure_root_logger(log_file)
+
+    # Create logger
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
 
     return logger
 
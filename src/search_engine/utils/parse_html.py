@@ -2,41 +2,146 @@
 This file will contain the code to extaract useful information from the crawled web pages
 """
 
+from functools import lru_cache
 from typing import List
-from bs4 import BeautifulSoup
+from lxml import etree, html
+from lxml.html import soupparser
 from urllib.parse import urlparse
 
+from src.search_engine.models.PageModel import PageModel
 from src.search_engine.utils.loggers import get_logger
 from src.search_engine.utils.variables import CommonVariables
+from src.search_engine.utils.string_utils import generate_content_hash
 
 logger = get_logger(__name__)
 
+# "{*}" matches the tag with or without a namespace, so the same lookups work on HTML and XHTML trees
+_HEADING_TAGS = tuple(f"{{*}}h{level}" for level in range(1, 7))
+_NON_CONTENT_TAGS = ("{*}script", "{*}style", "{*}nav", "{*}footer", "{*}header")
 
-def extract_outgoing_links_from_soup(soup: BeautifulSoup) -> List[str]:
+# Parser instances are reused for every page parsed by the worker process, the HTML parsers
+# are created once per encoding by _get_html_parser
+_XML_PARSER = etree.XMLParser(recover=True)
+
+
+@lru_cache(maxsize=None)
+def _get_html_parser(encoding: str) -> html.HTMLParser:
+    """
+    This method will create the HTML parser for the given encoding once and return the same parser afterwards
+
+    Args:
+        encoding (str): Encoding the parser decodes the content with.
+
+    Returns:
+        html.HTMLParser: The HTML parser for the encoding.
     """
-    This method will extract all the outgoing links from the given BeautifulSoup object.
+
+    return html.HTMLParser(encoding=encoding)
+
+
+def _get_html_parser_for_content(
+    content: bytes, encoding: str | None
+) -> html.HTMLParser:
+    """
+    This method will pick the HTML parser that decodes the content with the right encoding.
+    Without a known encoding, UTF-8 is used when the content is valid UTF-8, otherwise lxml's
+    default parser reads the <meta charset> of the page and falls back to Latin-1.
 
     Args:
-        soup (BeautifulSoup): The BeautifulSoup object representing the HTML content.
+        content (bytes): Raw content of the page.
+        encoding (str | None): Charset declared in the Content-Type header of the response.
+
+    Returns:
+        html.HTMLParser: The HTML parser to parse the content with.
+    """
+
+    if encoding:
+        try:
+            return _get_html_parser(encoding.lower())
+        except LookupError:
+            logger.debug("Unknown charset %s, detecting the encoding instead", encoding)
+
+    try:
+        content.decode("utf-8")
+    except UnicodeDecodeError:
+        return html.html_parser
+    return _get_html_parser("utf-8")
+
+
+def parse_content_into_tree(
+    content: bytes, is_xml: bool = False, encoding: str | None = None
+) -> etree._Element:
+    """
+    This method will parse the raw content of a page into an lxml tree.
+
+    Args:
+        content (bytes): Raw content of the page.
+        is_xml (bool): Whether the content should be parsed as XML instead of HTML.
+        encoding (str | None): Charset declared in the Content-Type header of the response.
+            XML content is decoded from its own declaration, which defaults to UTF-8.
+
+    Returns:
+        etree._Element: Root element of the parsed document.
+    """
+
+    if is_xml:
+        tree = etree.fromstring(content, _XML_PARSER)
+    else:
+        tree = html.document_fromstring(
+            content, parser=_get_html_parser_for_content(content, encoding)
+        )
+
+    if tree is None:
+        raise ValueError("Could not find any element in the document")
+    return tree
+
+
+def _get_text_from_element(element: etree._Element, separator: str = "") -> str:
+    """
+    This method will join the stripped, non-empty text nodes present under the given element.
+
+    Args:
+        element (etree._Element): The element to read the text from.
+        separator (str): String used to join the text nodes.
+
+    Returns:
+        str: The text present under the element.
+    """
+
+    strings = (string.strip() for string in element.itertext())
+    return separator.join(string for string in strings if string)
+
+
+def extract_outgoing_links_from_tree(tree: etree._Element) -> List[str]:
+    """
+    This method will extract all the outgoing links from the given lxml tree.
+
+    Args:
+        tree (etree._Element): The lxml tree representing the HTML content.
 
     Returns:
         List[str]: A list of outgoing links found in the HTML content.
     """
 
-    link_tags = soup.find_all("a", href=True)
     links = []
+    # Pages link the same targets many times (navigation boxes, footers), each href is
+    # checked and returned only once, in the order of its first occurrence
+    seen_hrefs = set()
 
-    for link in link_tags:
+    for link in tree.iter("{*}a"):
         href = link.get("href")
+        if href is None or href in seen_hrefs:
+            continue
+        seen_hrefs.add(href)
 
         # if not href or not href.startswith("https://"):
         #     continue
 
-        # Skip if URL ends with non-HTML file extensions
-        if any(href.lower().endswith(ext) for ext in CommonVariables.SKIP_EXTENSIONS):
-            continue
-
-        if href.lower().startswith(("mailto:", "javascript:", "tel:", "#")):
+        # Skip if URL ends with non-HTML file extensions or is a mailto/javascript/tel/fragment link
+        lowered_href = href.lower()
+        if lowered_href.endswith(
+            CommonVariables.SKIP_EXTENSIONS
+        ) or lowered_href.startswith(CommonVariables.SKIP_LINK_PREFIXES):
             continue
 
         # try:
@@ -56,67 +161,112 @@ def extract_outgoing_links_from_soup(soup: BeautifulSoup) -> List[str]:
         #     continue
 
         links.append(href)
-    logger.debug(f"Found {len(links)} valid links from accepted domains")
+    logger.debug("Found %d valid links from accepted domains", len(links))
     return links
 
 
-def extract_headings_from_soup(soup: BeautifulSoup) -> List[str]:
+def extract_headings_from_tree(tree: etree._Element) -> List[str]:
     """
-    This method will extract all the headings (h1-h6) from the given BeautifulSoup object.
+    This method will extract all the headings (h1-h6) from the given lxml tree.
 
     Args:
-        soup (BeautifulSoup): The BeautifulSoup object representing the HTML content.
+        tree (etree._Element): The lxml tree representing the HTML content.
 
     Returns:
         List[str]: A list of all heading texts found in the HTML content.
     """
 
-    heading_tags = soup.find_all(["h1", "h2", "h3", "h4", "h5", "h6"])
     headings = [
-        tag.get_text(strip=True) for tag in heading_tags if tag.get_text(strip=True)
+        text
+        for tag in tree.iter(*_HEADING_TAGS)
+        if (text := _get_text_from_element(tag))
     ]
-    logger.debug(f"Found {len(headings)} headings")
+    logger.debug("Found %d headings", len(headings))
     return headings
 
 
-def extract_title_from_soup(soup: BeautifulSoup) -> str:
+def extract_title_from_tree(tree: etree._Element) -> str:
     """
-    This method will extract the page title from the given BeautifulSoup object.
+    This method will extract the page title from the given lxml tree.
 
     Args:
-        soup (BeautifulSoup): The BeautifulSoup object representing the HTML content.
+        tree (etree._Element): The lxml tree representing the HTML content.
 
     Returns:
         str: The page title, or an empty string if no title is found.
     """
 
-    title_tag = soup.find("title")
-    title = title_tag.get_text(strip=True) if title_tag else ""
-    logger.debug(f"Found title: {title}")
+    title_tag = next(tree.iter("{*}title"), None)
+    title = _get_text_from_element(title_tag) if title_tag is not None else ""
+    logger.debug("Found title: %s", title)
     return title
 
 
-def extract_content_from_soup(soup: BeautifulSoup) -> str:
+def extract_content_from_tree(tree: etree._Element) -> str:
     """
-    This method will extract the main text content from the given BeautifulSoup object.
+    This method will extract the main text content from the given lxml tree.
 
     Args:
-        soup (BeautifulSoup): The BeautifulSoup object representing the HTML content.
+        tree (etree._Element): The lxml tree representing the HTML content.
 
     Returns:
         str: The extracted text content from the page.
     """
 
     # Remove script and style elements
-    for script in soup(["script", "style", "nav", "footer", "header"]):
-        script.decompose()
+    etree.strip_elements(tree, *_NON_CONTENT_TAGS, with_tail=False)
 
     # Get text content
-    text = soup.get_text(separator=" ", strip=True)
+    text = _get_text_from_element(tree, separator=" ")
 
-    # Clean up whitespace
-    lines = (line.strip() for line in text.splitlines())
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    text = " ".join(chunk for chunk in chunks if chunk)
-    logger.debug(f"Extracted content length: {len(text)} characters")
+    # Clean up whitespace, str.split() drops every run of whitespace in a single C level pass
+    text = " ".join(text.split())
+    logger.debug("Extracted content length: %d characters", len(text))
     return text
+
+
+def make_page_model_from_content(
+    url: str,
+    final_url: str,
+    http_status: int,
+    content: bytes,
+    is_xml: bool = False,
+    encoding: str | None = None,
+) -> PageModel:
+    """
+    This method will parse the raw content of a crawled page and build its page model.
+    It only takes picklable arguments, so it can be run in a worker process.
+
+    Args:
+        url (str): URL which was requested.
+        final_url (str): URL of the page after following redirects.
+        http_status (int): Status code of the response.
+        content (bytes): Raw content of the page.
+        is_xml (bool): Whether the content should be parsed as XML instead of HTML.
+        encoding (str | None): Charset declared in the Content-Type header of the response.
+
+    Returns:
+        PageModel: The page model built for the page.
+    """
+
+    # Parsing with lxml, falling back to BeautifulSoup for documents lxml rejects
+    try:
+        tree = parse_content_into_tree(content, is_xml=is_xml, encoding=encoding)
+    except Exception as parse_error:
+        logger.warning(
+            "Failed to parse %s with lxml, trying BeautifulSoup: %s", url, parse_error
+        )
+        tree = soupparser.fromstring(content, from_encoding=encoding)
+
+    # Fetching required details
+    page_content = extract_content_from_tree(tree)
+    return PageModel(
+        doc_id=generate_content_hash(page_content),
+        url=url,
+        final_url=final_url,
+        http_status=http_status,
+        title=extract_title_from_tree(tree),
+        headings=extract_headings_from_tree(tree),
+        content=page_content,
+        links=extract_outgoing_links_from_tree(tree),
+    )
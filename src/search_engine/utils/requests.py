@@ -2,14 +2,19 @@
 This file will contain the code to handle HTTP requests
 """
 
-from typing import List
+from collections import defaultdict
+from typing import AsyncIterator, List
 import asyncio
 import httpx
 
 from src.search_engine.utils.loggers import get_logger
+from src.search_engine.utils.variables import CommonVariables
 
 logger = get_logger(__name__)
 
+# Headers describing the body as sent, which no longer hold once the body has been decoded
+_DECODED_BODY_STALE_HEADERS = {"content-encoding", "content-length"}
+
 
 def prepare_async_requests(
     urls: List[str], async_rest_client: httpx.AsyncClient = None
@@ -28,34 +33,135 @@ def prepare_async_requests(
     if async_rest_client is None:
         async_rest_client = httpx.AsyncClient()
 
-    requests = []
-    for url in urls:
-        logger.debug(f"Preparing request for URL: {url}")
-        request = async_rest_client.build_request("GET", url)
-        requests.append(request)
+    build_request = async_rest_client.build_request
+    requests = [build_request("GET", url) for url in urls]
 
-    logger.debug(f"Prepared {len(requests)} requests: {requests}")
+    logger.debug("Prepared %d requests", len(requests))
     return requests
 
 
+async def _read_response_with_size_cap(
+    response: httpx.Response, max_bytes: int
+) -> httpx.Response:
+    """
+    This method will read the body of a streamed response, giving up as soon as it
+    grows past max_bytes so huge documents are never fully downloaded or parsed.
+
+    Args:
+        response (httpx.Response): The streamed HTTP response.
+        max_bytes (int): Maximum number of body bytes to read.
+
+    Returns:
+        httpx.Response: A response holding the already decoded body.
+    """
+
+    url = response.request.url
+    try:
+        # Short-circuiting on the announced size before reading anything
+        content_length = response.headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            raise ValueError(
+                f"Response for URL [{url}] announces {content_length} bytes, more than {max_bytes}"
+            )
+
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            if len(body) > max_bytes:
+                raise ValueError(
+                    f"Response for URL [{url}] is larger than {max_bytes} bytes"
+                )
+    finally:
+        await response.aclose()
+
+    # The body is already decoded, so the content encoding must not be applied again and the
+    # announced length of the encoded body is dropped, httpx sets the length of the decoded one
+    headers = [
+        (key, value)
+        for key, value in response.headers.multi_items()
+        if key.lower() not in _DECODED_BODY_STALE_HEADERS
+    ]
+    return httpx.Response(
+        response.status_code,
+        headers=headers,
+        content=bytes(body),
+        request=response.request,
+        history=response.history,
+        extensions=response.extensions,
+    )
+
+
+async def _send_request_with_host_limit(
+    request: httpx.Request,
+    async_rest_client: httpx.AsyncClient,
+    host_semaphore: asyncio.Semaphore,
+    max_bytes: int,
+) -> httpx.Response:
+    """
+    This method will send the given request once its host has a free slot.
+
+    Args:
+        request (httpx.Request): The prepared HTTP request.
+        async_rest_client (httpx.AsyncClient): An instance of httpx.AsyncClient to send the request.
+        host_semaphore (asyncio.Semaphore): Semaphore limiting the in-flight requests for the request's host.
+        max_bytes (int): Maximum number of body bytes to read.
+
+    Returns:
+        httpx.Response: The HTTP response.
+    """
+
+    async with host_semaphore:
+        response = await async_rest_client.send(request, stream=True)
+        return await _read_response_with_size_cap(response, max_bytes)
+
+
 async def hit_async_requests(
-    requests: List[httpx.Request], async_rest_client: httpx.AsyncClient = None
-) -> List[httpx.Response]:
+    requests: List[httpx.Request],
+    async_rest_client: httpx.AsyncClient = None,
+    host_semaphores: dict[str, asyncio.Semaphore] = None,
+    max_bytes: int = CommonVariables.MAX_RESPONSE_BYTES,
+) -> AsyncIterator[httpx.Response | Exception]:
     """
-    This method will send asynchronous HTTP requests and return their responses.
+    This method will send asynchronous HTTP requests and yield each response as soon as
+    it completes, so they come in completion order and not in request order.
+    At most MAX_REQUESTS_PER_HOST requests are in flight for a single host at a time.
+    A failed request, or a response body larger than max_bytes, is yielded as its exception.
 
     Args:
         requests (List[httpx.Request]): A list of prepared HTTP requests.
         async_rest_client (httpx.AsyncClient): An instance of httpx.AsyncClient to send requests.
+        host_semaphores (dict[str, asyncio.Semaphore]): Semaphores per host, shared across calls.
+        max_bytes (int): Maximum number of body bytes to read per response.
 
-    Returns:
-        List[httpx.Response]: A list of HTTP responses.
+    Yields:
+        httpx.Response | Exception: The HTTP response, or the exception raised for the request.
     """
 
     if async_rest_client is None:
         async_rest_client = httpx.AsyncClient()
 
-    logger.debug(f"Hitting {len(requests)} requests asynchronously: {requests}")
-    tasks = [async_rest_client.send(req) for req in requests]
-    responses = await asyncio.gather(*tasks, return_exceptions=True)
-    return responses
+    if host_semaphores is None:
+        host_semaphores = defaultdict(
+            lambda: asyncio.Semaphore(CommonVariables.MAX_REQUESTS_PER_HOST)
+        )
+
+    logger.debug("Hitting %d requests asynchronously", len(requests))
+    tasks = [
+        asyncio.create_task(
+            _send_request_with_host_limit(
+                req, async_rest_client, host_semaphores[req.url.host], max_bytes
+            )
+        )
+        for req in requests
+    ]
+    try:
+        for next_response in asyncio.as_completed(tasks):
+            try:
+                yield await next_response
+            except Exception as e:
+                yield e
+    finally:
+        # Cancelling the requests still in flight when the caller stops early or is cancelled,
+        # so they are not left running on their own
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,143 @@
+"""
+This file will contain a hash set of URL fingerprints kept in shared memory, so several
+crawler processes can share the same visited URLs.
+"""
+
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+
+# An empty slot holds 0, so a fingerprint equal to 0 is stored as 1 instead
+_EMPTY_SLOT = 0
+_SLOT_SIZE = 8
+
+
+class SharedVisited:
+    """
+    A fixed size open-addressing hash set of 64-bit fingerprints (see generate_url_fingerprint)
+    stored in a SharedMemory block. Lookups read the table directly, additions are serialized
+    with a process shared lock. The set can be handed to child processes when they are started.
+
+    This is groundwork for splitting the crawl over several processes: today only the crawler's
+    own process uses the set, and nothing reads the return value of add yet.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        """
+        Constructor for our shared visited set
+
+        Args:
+            capacity: number of fingerprints the set must be able to hold
+        """
+
+        # Using a power of two of at least twice the capacity, which keeps the load factor
+        # at or below 0.5 and lets a mask replace the modulo when probing
+        slot_count = 1 << max(1, (2 * capacity - 1).bit_length())
+        self._shared_memory = SharedMemory(create=True, size=slot_count * _SLOT_SIZE)
+        self._owner = True
+        self._attach(slot_count)
+        self._lock = multiprocessing.Lock()
+        self._count = multiprocessing.Value("Q", 0, lock=False)
+
+    def _attach(self, slot_count: int) -> None:
+        """
+        This method will map the shared memory block as a table of unsigned 64-bit slots
+
+        Args:
+            slot_count: number of slots in the table
+
+        Returns:
+            None
+        """
+
+        self._slots = self._shared_memory.buf.cast("Q")
+        self._mask = slot_count - 1
+
+    def __getstate__(self) -> dict:
+        return {
+            "name": self._shared_memory.name,
+            "slot_count": self._mask + 1,
+            "lock": self._lock,
+            "count": self._count,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self._shared_memory = SharedMemory(name=state["name"])
+        self._owner = False
+        self._attach(state["slot_count"])
+        self._lock = state["lock"]
+        self._count = state["count"]
+
+    def _find_slot(self, fingerprint: int) -> int:
+        """
+        This method will probe the table linearly, starting from the fingerprint's home slot
+
+        Args:
+            fingerprint: non zero 64-bit fingerprint
+
+        Returns:
+            int: index of the slot holding the fingerprint, or of the first empty slot found
+        """
+
+        slots = self._slots
+        mask = self._mask
+        index = fingerprint & mask
+        for _ in range(mask + 1):
+            value = slots[index]
+            if value == fingerprint or value == _EMPTY_SLOT:
+                return index
+            index = (index + 1) & mask
+
+        raise ValueError("Shared visited set is full")
+
+    def add(self, fingerprint: int) -> bool:
+        """
+        This method will add the fingerprint in the set
+
+        Args:
+            fingerprint: 64-bit fingerprint of the URL
+
+        Returns:
+            bool: True if the fingerprint was added, False if it was already present
+        """
+
+        fingerprint = fingerprint or 1
+        with self._lock:
+            index = self._find_slot(fingerprint)
+            if self._slots[index] == fingerprint:
+                return False
+
+            self._slots[index] = fingerprint
+            self._count.value += 1
+            return True
+
+    def __contains__(self, fingerprint: int) -> bool:
+        fingerprint = fingerprint or 1
+        return self._slots[self._find_slot(fingerprint)] == fingerprint
+
+    def __len__(self) -> int:
+        return self._count.value
+
+    def close(self) -> None:
+        """
+        This method will detach this process from the shared memory block, the process
+        which created the set also frees the block. Closing an already closed set does nothing
+
+        Returns:
+            None
+        """
+
+        if self._slots is None:
+            return
+
+        # The view on the block must be released before the block itself can be closed
+        self._slots.release()
+        self._slots = None
+        self._shared_memory.close()
+        if self._owner:
+            self._shared_memory.unlink()
+
+    def __del__(self) -> None:
+        # Copies attached in child processes are usually never closed explicitly, the view
+        # must still be released before SharedMemory's own finalizer closes the block
+        if getattr(self, "_slots", None) is not None:
+            self.close()
@@ -3,6 +3,7 @@ This file will contain some utility methods for string operations.
 """
 
 from urllib.parse import urlparse, urlunparse, urljoin
+from functools import lru_cache
 from typing import List
 import hashlib
 
@@ -11,6 +12,67 @@ from src.search_engine.utils.variables import CommonVariables
 
 logger = get_logger(__name__)
 
+_FAST_PATH_UNSUPPORTED_CHARS = ("\t", "\r", "\n", ";", "[", "]")
+
+
+# The same absolute links (navigation, footers) show up on most pages of a site, so their
+# normalized form is cached. Only the URL is the key, the result does not depend on the source page
+@lru_cache(maxsize=CommonVariables.NORMALIZE_URL_CACHE_SIZE)
+def _normalize_absolute_http_url(url: str) -> str | None:
+    """
+    Normalize an absolute http(s) URL with plain string operations, giving the same
+    result as the urllib.parse based path of normalize_url.
+
+    Args:
+        url (str): The stripped URL to normalize.
+    Returns:
+        str: The normalized URL, or None if the URL needs the full urllib.parse handling.
+    """
+
+    # Non-ASCII hosts, IPv6 literals, path params and characters urllib.parse strips
+    # all need the full parser
+    if not url.startswith(("http://", "https://")) or not url.isascii():
+        return None
+    if any(char in url for char in _FAST_PATH_UNSUPPORTED_CHARS):
+        return None
+
+    # Splitting in the same order as urlsplit: fragment first, then query, then netloc
+    scheme, _, rest = url.partition("://")
+    rest = rest.partition("#")[0]
+    rest, _, query = rest.partition("?")
+    netloc, slash, path = rest.partition("/")
+    if not netloc:
+        return None
+
+    # Normalize path: remove trailing slash (except for root "/")
+    path = slash + path
+    path = path.rstrip("/") if path != "/" else "/"
+
+    normalized = f"{scheme}://{netloc.lower()}{path}"
+    return f"{normalized}?{query}" if query else normalized
+
+
+def _join_root_relative_url(url: str, source_url: str) -> str | None:
+    """
+    Join a root-relative link (like "/wiki/Page") with the scheme and host of its source
+    page, giving the same result as urljoin for such links.
+
+    Args:
+        url (str): The stripped link, starting with a single "/".
+        source_url (str): Source URL
+    Returns:
+        str: The absolute URL, or None if the link needs urljoin.
+    """
+
+    # urljoin removes the "." and ".." segments, only links without them are joined here
+    if "/." in url or not source_url.startswith(("http://", "https://")):
+        return None
+
+    scheme, _, rest = source_url.partition("://")
+    for separator in "/?#":
+        rest = rest.partition(separator)[0]
+    return f"{scheme}://{rest}{url}" if rest else None
+
 
 def normalize_url(url: str, source_url: str = None) -> str:
     """
@@ -23,11 +85,22 @@ def normalize_url(url: str, source_url: str = None) -> str:
         str: The normalized URL.
     """
 
-    logger.debug(f"Normalizing URL: {url}")
+    logger.debug("Normalizing URL: %s", url)
 
-    # Parse the URL into components
+    # Nearly every crawled link is an absolute http(s) URL or a root-relative link,
+    # these skip urllib.parse
     url = url.strip()
-    parsed = urlparse(url.strip())
+    if url.startswith("/") and not url.startswith("//") and source_url:
+        joined_url = _join_root_relative_url(url, source_url)
+        normalized = _normalize_absolute_http_url(joined_url) if joined_url else None
+    else:
+        normalized = _normalize_absolute_http_url(url)
+    if normalized is not None:
+        logger.debug("Normalized URL: %s", normalized)
+        return normalized
+
+    # Parse the URL into components
+    parsed = urlparse(url)
 
     # Joining the relative link with its source
     if not parsed.scheme:
@@ -51,33 +124,78 @@ def normalize_url(url: str, source_url: str = None) -> str:
 
     # Reconstruct the URL without fragment
     normalized = urlunparse((scheme, netloc, path, parsed.params, query, fragment))
-    logger.debug(f"Normalized URL: {normalized}")
+    logger.debug("Normalized URL: %s", normalized)
 
     return normalized
 
 
-def generate_content_hash(content: str) -> str:
+def generate_content_hash(content: str | bytes) -> str:
     """
     Generate an SHA-256 hash of the content.
+    The hash is only used as a document id, OpenSSL's SHA-256 uses the CPU's SHA
+    instructions when available, which makes it faster than blake2b here.
 
     Args:
-        content (str): The content to hash.
+        content (str | bytes): The content to hash, bytes are hashed as they are
+            while text is encoded as UTF-8 first.
 
     Returns:
         str: The hexadecimal hash string.
     """
-    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content, usedforsecurity=False).hexdigest()
+
+
+def generate_url_fingerprint(url: str) -> int:
+    """
+    Generate a 64-bit fingerprint of the URL, used to remember visited URLs
+    without keeping the URL strings themselves.
+
+    Args:
+        url (str): The URL to fingerprint.
+
+    Returns:
+        int: The fingerprint of the URL.
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest())
+
+
+def get_host_from_url(url: str) -> str:
+    """
+    This method will return the network location (host and port) of an absolute URL,
+    without going through a full urlparse.
+
+    Args:
+        url (str): The absolute URL.
+
+    Returns:
+        str: The network location of the URL, or an empty string if it has none.
+    """
+
+    authority = url.partition("://")[2]
+    for separator in ("/", "?", "#"):
+        authority = authority.partition(separator)[0]
+    return authority
 
 
-def tokenize_content_into_list_of_words(content: str) -> List[str]:
+def tokenize_content_into_list_of_words(
+    content: str, drop_stop_words: bool = False
+) -> List[str]:
     """
     This method will tokenize the content into words using regex
 
     Args:
         content: content of the webpage
+        drop_stop_words: whether the stop words should be left out of the tokens
 
     Returns:
         tokenize set of words
     """
 
-    return [token.lower() for token in CommonVariables.TOKEN_PATTERN.findall(content)]
+    # Lowercasing the whole content once, instead of every token found in it
+    tokens = CommonVariables.TOKEN_PATTERN.findall(content.lower())
+    if drop_stop_words:
+        stop_words = CommonVariables.STOP_WORDS
+        return [token for token in tokens if token not in stop_words]
+    return tokens
@@ -15,13 +15,25 @@ class CommonVariables:
         "https://github.com/priyanshum143",
     ]
     MAX_LIMIT = 10000
+    NORMALIZE_URL_CACHE_SIZE = 200_000
     BATCH_SIZE = 100
+    JSONL_BUFFER_SOFT_MAX = 1 << 20
+    INDEX_CHECKPOINT_SIZE = 500
     HEADERS = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     }
     TIMEOUT = 10
+    CONNECT_TIMEOUT = 5
+    CONNECT_RETRIES = 1
+    MAX_CONNECTIONS = 500
+    MAX_KEEPALIVE_CONNECTIONS = 200
+    KEEPALIVE_EXPIRY = 60
+    MAX_REQUESTS_PER_HOST = 8
+    MAX_RESPONSE_BYTES = 2 * 1024 * 1024
+    DEFAULT_EXECUTOR_WORKERS = 64
     ACCEPTED_DOMAINS = ["wikipedia.org", "en.wikipedia.org"]
-    SKIP_EXTENSIONS = [
+    # Tuples, so a single str.endswith / str.startswith call checks every entry
+    SKIP_EXTENSIONS = (
         ".css",
         ".js",
         ".png",
@@ -34,51 +46,59 @@ class CommonVariables:
         ".woff2",
         ".ttf",
         ".pdf",
-    ]
+    )
+    SKIP_LINK_PREFIXES = ("mailto:", "javascript:", "tel:", "#")
 
-    STOP_WORDS = [
-        "a",
-        "an",
-        "the",
-        "and",
-        "or",
-        "but",
-        "is",
-        "am",
-        "are",
-        "was",
-        "were",
-        "have",
-        "has",
-        "had",
-        "of",
-        "to",
-        "in",
-        "on",
-        "for",
-        "at",
-        "by",
-        "yes",
-        "no",
-        "would" "should",
-        "could",
-        "he",
-        "she",
-        "his",
-        "him",
-        "her",
-        "they",
-        "them",
-        "as",
-        "at",
-        "you",
-        "me",
-        "we",
-        "us",
-    ]
-    TOKEN_PATTERN = re.compile(r"\b[a-zA-Z0-9]+\b")
+    # A frozenset, as every indexed term and query token is looked up in it
+    STOP_WORDS = frozenset(
+        [
+            "a",
+            "an",
+            "the",
+            "and",
+            "or",
+            "but",
+            "is",
+            "am",
+            "are",
+            "was",
+            "were",
+            "have",
+            "has",
+            "had",
+            "of",
+            "to",
+            "in",
+            "on",
+            "for",
+            "at",
+            "by",
+            "yes",
+            "no",
+            "would",
+            "should",
+            "could",
+            "he",
+            "she",
+            "his",
+            "him",
+            "her",
+            "they",
+            "them",
+            "as",
+            "at",
+            "you",
+            "me",
+            "we",
+            "us",
+        ]
+    )
+    # Applied on lowercased text, see tokenize_content_into_list_of_words
+    TOKEN_PATTERN = re.compile(r"\b[a-z0-9]+\b")
     RESPONSE_SIZE = 10
     TOP_K_PER_TERM = 50
+    SNIPPET_LENGTH = 240
+    RESULT_CACHE_SIZE = 1024
 
     ROOT_DIR = Path(__file__).parent.parent.parent.parent
     JSONL_FILE_PATH = ROOT_DIR / "src" / "search_engine" / "data" / "PageModel.jsonl"